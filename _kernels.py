@@ -0,0 +1,116 @@
+"""Numeric kernels, compiled with Numba when it is installed.
+
+Numba, and NumPy through it, is the script's only optional accelerator:
+it compiles the membership kernel and runs batch simulations in parallel.
+Code that depends on it lives in this module, and everything else runs
+without it.
+
+The kernels use cache=True, so Numba compiles them once and stores the
+machine code in __pycache__/ next to this file (_kernels.*.nbi / .nbc).
+Later runs of the script load it from there instead of recompiling.
+fuzzify has an explicit signature and is compiled on import. The batch
+kernel is compiled on its first call, and its cost does not depend on
+the rule base. Without Numba, njit is a no-op and the
+kernels run as plain Python.
+"""
+
+try:
+    import numpy as np
+    from numba import njit, prange
+    HAVE_NUMBA = True
+except ImportError:  # numba is optional; the kernels run as plain Python
+    HAVE_NUMBA = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+@njit("float64(float64, float64, float64, float64, float64, float64, float64)", cache=True, fastmath=True)
+def fuzzify(a, b, c, d, inv_ba, inv_dc, x):
+    """Membership degree of x in the trapezoid (a, b, c, d).
+
+    inv_ba and inv_dc are the precomputed edge slopes 1/(b-a) and 1/(d-c),
+    or 0 for a vertical edge. Adding the (x >= b) / (x <= c) comparisons
+    saturates each side on the plateau, which also turns a vertical edge
+    into a step, so the whole shape is one clamp with no branches.
+    """
+    return max(0.0, min((x - a) * inv_ba + (x >= b), 1.0, (d - x) * inv_dc + (x <= c)))
+
+@njit(parallel=True, cache=True)
+def _simulate_rows(x, params, slot_input, ant_start, ant_slot, ant_op, last_or, rule_row, rule_col, centroids):
+    n_slots = params.shape[0]
+    n_outputs, n_sets = centroids.shape
+    out = np.empty((x.shape[0], n_outputs))
+    for i in prange(x.shape[0]):
+        mu = np.zeros(n_slots + 1)  # The trailing slot stays 0 for unknown sets
+        for s in range(n_slots):
+            p = params[s]
+            mu[s] = fuzzify(p[0], p[1], p[2], p[3], p[4], p[5], x[i, slot_input[s]])
+
+        inferred = np.zeros((n_outputs, n_sets))
+        for k in range(rule_row.shape[0]):
+            r = 1.0
+            for t in range(ant_start[k], ant_start[k + 1]):
+                m = mu[ant_slot[t]]
+                if ant_op[t] == 0:  # Op.AND
+                    r = min(r, m)
+                elif ant_op[t] == 1:  # Op.OR
+                    r = max(r, m)
+                else:  # Op.AND_NOT
+                    r = min(r, 1.0 - m)
+                if r == 0.0 and t >= last_or[k]:
+                    break  # Only 'or' can raise a zero degree again
+            if r > inferred[rule_row[k], rule_col[k]]:
+                inferred[rule_row[k], rule_col[k]] = r
+
+        for v in range(n_outputs):
+            numerator = 0.0
+            denominator = 0.0
+            for j in range(n_sets):
+                numerator += inferred[v, j] * centroids[v, j]
+                denominator += inferred[v, j]
+            out[i, v] = numerator / denominator if denominator > 0 else 0.0
+    return out
+
+def pack_rule_base(slot_params, slot_inputs, rule_table, centroids):
+    """Pack a compiled rule base into the arrays simulate_batch reads.
+
+    slot_params and slot_inputs give each input set's packed trapezoid and
+    the input it reads; rule_table holds (antecedents, out_row, out_col)
+    with (slot, op) antecedents; centroids has one list per output. Only
+    available with Numba.
+    """
+    ant_start = [0]
+    ant_slot, ant_op, last_or, rule_row, rule_col = [], [], [], [], []
+    for antecedents, out_row, out_col in rule_table:
+        last_or.append(ant_start[-1] - 1)
+        for slot, op in antecedents:
+            if op == 1:  # Op.OR
+                last_or[-1] = len(ant_slot)
+            ant_slot.append(slot)
+            ant_op.append(op)
+        ant_start.append(len(ant_slot))
+        rule_row.append(out_row)
+        rule_col.append(out_col)
+
+    n_sets = max((len(row) for row in centroids), default=0)
+    centroid_table = np.zeros((len(centroids), n_sets))
+    for v, row in enumerate(centroids):
+        centroid_table[v, :len(row)] = row
+
+    ints = lambda values: np.asarray(values, dtype=np.int64)
+    return (
+        np.asarray(slot_params, dtype=np.float64).reshape(len(slot_params), 6),
+        ints(slot_inputs), ints(ant_start), ints(ant_slot), ints(ant_op),
+        ints(last_or), ints(rule_row), ints(rule_col), centroid_table,
+    )
+
+def simulate_batch(packed, rows, n_inputs):
+    """Evaluate a packed rule base over every row of crisp values, in parallel.
+
+    Only available with Numba; returns one list of outputs per row.
+    """
+    x = np.asarray(rows, dtype=np.float64).reshape(len(rows), n_inputs)
+    return _simulate_rows(x, *packed).tolist()
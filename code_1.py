@@ -1,40 +1,87 @@
 import ast
+import logging
+import math
+import re
+from enum import IntEnum
+
+from _kernels import HAVE_NUMBA, pack_rule_base, simulate_batch
+from _kernels import fuzzify as _fuzzify
+
+logger = logging.getLogger(__name__)
+
+_RULE_ARROW = re.compile(r"\s*=>\s*")
+_RULE_TOK = re.compile(r"\s*(\S+)\s+(\S+)(?:\s+(and_not|and|or)(?=\s|$))?")
+
+class Op(IntEnum):
+    AND = 0
+    OR = 1
+    AND_NOT = 2
+
+_OPS = {"and": Op.AND, "or": Op.OR, "and_not": Op.AND_NOT}
+
+def _parse_antecedents(in_part):
+    """Split 'var set [op] var set [op] ...' into (var, set, op) triples.
+
+    The operator defaults to "and". Raises ValueError unless the groups cover
+    the whole string, so stray or missing tokens are reported, not dropped.
+    """
+    in_vars = []
+    pos = 0
+    in_part = in_part.rstrip()
+    for m in _RULE_TOK.finditer(in_part):
+        if m.start() != pos:
+            break
+        in_vars.append((m[1], m[2], m[3] or "and"))
+        pos = m.end()
+    if not in_vars or pos != len(in_part):
+        raise ValueError("Invalid rule format. Use 'var set op var set => out_var out_set'.")
+    return in_vars
 
 class FuzzySet:
     def __init__(self, name, type_, values):
         self.name = name
         self.type = type_.upper()
         self.values = values
-
-    def fuzzify(self, crisp_value):
+        if not all(math.isfinite(v) for v in values):
+            raise ValueError(f"Fuzzy set values must be finite: {values}")
         if self.type == "TRI":
-            a, b, c = self.values
-            if a <= crisp_value <= b:
-                return (crisp_value - a) / (b - a)
-            elif b <= crisp_value <= c:
-                return (c - crisp_value) / (c - b)
-            else:
-                return 0
+            a, b, d = values
+            c = b
         elif self.type == "TRAP":
-            a, b, c, d = self.values
-            if a <= crisp_value <= b:
-                return (crisp_value - a) / (b - a)
-            elif b <= crisp_value <= c:
-                return 1
-            elif c <= crisp_value <= d:
-                return (d - crisp_value) / (d - c)
-            else:
-                return 0
+            a, b, c, d = values
+        else:
+            raise ValueError(f"Unknown fuzzy set type: {type_}")
+        self._a, self._b, self._c, self._d = float(a), float(b), float(c), float(d)
+        self._inv_ba = 0.0 if self._b == self._a else 1.0 / (self._b - self._a)
+        self._inv_dc = 0.0 if self._d == self._c else 1.0 / (self._d - self._c)
+        self.centroid = float(sum(values) / len(values))
+
+    def fuzzify(self, crisp_value):
+        return _fuzzify(self._a, self._b, self._c, self._d, self._inv_ba, self._inv_dc, crisp_value)
 
 class Variable:
     def __init__(self, name, var_type, range_):
         self.name = name
         self.type = var_type.upper()
         self.range = range_
-        self.fuzzy_sets = {}
+        self.sets = []
+        self.set_names = {}
+        self._abcd = None
 
     def add_fuzzy_set(self, fuzzy_set):
-        self.fuzzy_sets[fuzzy_set.name] = fuzzy_set
+        idx = self.set_names.get(fuzzy_set.name)
+        if idx is None:
+            self.set_names[fuzzy_set.name] = len(self.sets)
+            self.sets.append(fuzzy_set)
+        else:
+            self.sets[idx] = fuzzy_set  # Redefining a set keeps its position
+        self._abcd = None
+
+    def _compile(self):
+        # Pack every set as a trapezoid (a, b, c, d) plus its edge slopes; a
+        # triangle repeats its peak.
+        self._abcd = [(fs._a, fs._b, fs._c, fs._d, fs._inv_ba, fs._inv_dc) for fs in self.sets]
+        self._centroids = [fs.centroid for fs in self.sets]
 
 class FuzzySystem:
     def __init__(self, name, description):
@@ -42,65 +89,208 @@ class FuzzySystem:
         self.description = description
         self.variables = {}
         self.rules = []
+        self._rule_table = None
 
     def add_variable(self, variable):
         self.variables[variable.name] = variable
+        self._rule_table = None
 
     def add_rule(self, rule):
-        self.rules.append(rule)
-
-    def run_simulation(self, crisp_values):
-        fuzzified_values = {}
-        for var_name, crisp_value in crisp_values.items():
-            variable = self.variables.get(var_name)
-            if not variable:
-                print(f"Error: Variable '{var_name}' not defined.")
-                return
-            fuzzified_values[var_name] = {
-                fs_name: fs.fuzzify(crisp_value)
-                for fs_name, fs in variable.fuzzy_sets.items()
-            }
-
-        inferred_outputs = {}
-        for rule in self.rules:
-            in_vars, out_var, out_set = rule
-            min_degree = 1  
-
+        in_vars, out_var, out_set = rule
+        antecedents = []
+        for var_name, set_name, operator in in_vars:
+            op = operator if isinstance(operator, Op) else _OPS.get(operator)
+            if op is None:
+                logger.warning("Unknown operator: %s. Defaulting to 'and'.", operator)
+                op = Op.AND
+            antecedents.append((var_name, set_name, op))
+        self.rules.append((antecedents, out_var, out_set))
+        self._rule_table = None
+
+    def _compile_rules(self):
+        # Every set of every input variable gets a slot in one flat degree list;
+        # the extra trailing slot stays 0 and absorbs references to unknown set
+        # names of a known input variable.
+        for variable in self.variables.values():
+            variable._compile()
+        self._inputs = [v for v in self.variables.values() if v.type == "IN"]
+        self._in_var_index = {v.name: i for i, v in enumerate(self._inputs)}
+        self._var_offsets = {}
+        n_slots = 0
+        for variable in self._inputs:
+            self._var_offsets[variable.name] = n_slots
+            n_slots += len(variable._abcd)
+        self._n_slots = n_slots + 1
+
+        # Output variables get a row each, in order of first appearance in the rules.
+        self._outputs = []
+        output_rows = {}
+        self._rule_table = []
+        for in_vars, out_var, out_set in self.rules:
+            antecedents = []
             for var_name, set_name, operator in in_vars:
-                degree = fuzzified_values[var_name].get(set_name, 0)
-                if operator == "and":
-                    min_degree = min(min_degree, degree)
-                elif operator == "or":
-                    min_degree = max(min_degree, degree)
-                elif operator == "and_not":
-                    min_degree = min(min_degree, 1 - degree)
-                else:
-                    print(f"Unknown operator: {operator}. Defaulting to 'and'.")
-                    min_degree = min(min_degree, degree)  # Default to 'and' if unknown operator
-
-            if out_var not in inferred_outputs:
-                inferred_outputs[out_var] = {}
-
-            inferred_outputs[out_var][out_set] = max(
-                inferred_outputs[out_var].get(out_set, 0), min_degree
-            )
+                offset = self._var_offsets.get(var_name)
+                if offset is None:
+                    raise KeyError(var_name)  # Antecedents must name IN variables
+                set_idx = self.variables[var_name].set_names.get(set_name)
+                slot = n_slots if set_idx is None else offset + set_idx
+                antecedents.append((slot, int(operator)))
+            if out_var not in output_rows:
+                output_rows[out_var] = len(self._outputs)
+                self._outputs.append(self.variables[out_var])
+            out_col = self.variables[out_var].set_names[out_set]
+            self._rule_table.append((tuple(antecedents), output_rows[out_var], out_col))
+
+        self._program = self._generate_program()
+        self._packed = None
+        logger.debug(
+            "Compiled %d rules over %d input sets for system '%s'.",
+            len(self._rule_table), n_slots, self.name,
+        )
+
+    def _generate_program(self):
+        """Specialise the compiled rule base into one straight-line function.
+
+        The generated function takes a sequence with one crisp value per input
+        variable and returns a tuple with the defuzzified value of each output variable.
+        Set parameters, operators and centroids are baked in as constants;
+        memberships go through the shared _fuzzify kernel, and sets that no
+        rule reads are never fuzzified.
+        """
+        slot_sources = []
+        slot_inputs = []
+        for i, variable in enumerate(self._inputs):
+            for a, b, c, d, inv_ba, inv_dc in variable._abcd:
+                slot_inputs.append(i)
+                slot_sources.append(f"_fuzzify({a!r}, {b!r}, {c!r}, {d!r}, {inv_ba!r}, {inv_dc!r}, x{i})")
+
+        lines = []
+        used_slots = {}
+        self._read_inputs = set()
+
+        def degree(slot):
+            if slot == self._n_slots - 1:
+                return "0.0"
+            self._read_inputs.add(slot_inputs[slot])
+            if slot not in used_slots:
+                used_slots[slot] = f"m{slot}"
+                lines.append(f"    m{slot} = {slot_sources[slot]}")
+            return used_slots[slot]
+
+        # Everything below is emitted as flat statements, one operation per
+        # line, so neither long rules nor wide outputs nest expressions.
+        assigned = set()
+        for antecedents, out_row, out_col in self._rule_table:
+            # Fold from a starting degree of 1: 'or' against 1 stays 1, so r is
+            # only assigned once the first 'and' / 'and_not' is seen. Past the
+            # last 'or' a zero degree is final, so the remaining antecedents are
+            # guarded by 'if r:' and their sets are fuzzified only when reached.
+            last_or = max((i for i, (_, op) in enumerate(antecedents) if op == Op.OR), default=-1)
+            folded = False
+            for i, (slot, operator) in enumerate(antecedents):
+                if operator == Op.OR:
+                    if folded:
+                        lines.append(f"    r = max(r, {degree(slot)})")
+                    continue
+                if folded and i > last_or:
+                    if slot == self._n_slots - 1:
+                        mu = "0.0"
+                    else:
+                        self._read_inputs.add(slot_inputs[slot])
+                        mu = used_slots.get(slot, slot_sources[slot])
+                    term = mu if operator == Op.AND else f"1.0 - {mu}"
+                    lines.append(f"    if r: r = min(r, {term})")
+                    continue
+                term = degree(slot) if operator == Op.AND else f"1.0 - {degree(slot)}"
+                lines.append(f"    r = min(r, {term})" if folded else f"    r = {term}")
+                folded = True
+            if not folded:
+                lines.append("    r = 1.0")
+
+            out = f"o{out_row}_{out_col}"
+            lines.append(f"    {out} = max({out}, r)" if out in assigned else f"    {out} = r")
+            assigned.add(out)
+
+        results = []
+        for v, variable in enumerate(self._outputs):
+            first = True
+            for j, centroid in enumerate(variable._centroids):
+                out = f"o{v}_{j}"
+                if out in assigned:
+                    op = "=" if first else "+="
+                    lines.append(f"    den{v} {op} {out}")
+                    lines.append(f"    num{v} {op} {out} * {centroid!r}")
+                    first = False
+            results.append(f"num{v} / den{v} if den{v} > 0 else 0")
+
+        unpack = [f"    x{i} = x[{i}]" for i in range(len(self._inputs))]
+        returned = f"({', '.join(results)},)" if results else "()"
+        source = "\n".join(["def _program(x):", *unpack, *lines, f"    return {returned}"])
+        namespace = {"_fuzzify": _fuzzify}
+        exec(compile(source, f"<fuzzy system {self.name!r}>", "exec"), namespace)
+        self._program_source = source
+        return namespace["_program"]
+
+    def _ensure_compiled(self):
+        if self._rule_table is None or any(v._abcd is None for v in self.variables.values()):
+            self._compile_rules()
 
-        results = {}
-        for var_name, output in inferred_outputs.items():
-            numerator = 0
-            denominator = 0
-            variable = self.variables[var_name]
-            for set_name, degree in output.items():
-                if degree in [float("inf"), float("-inf")]:
-                    continue  # Skip invalid degrees
-                fs = variable.fuzzy_sets[set_name]
-                centroid = sum(fs.values) / len(fs.values)  # Calculate centroid of fuzzy set
-                numerator += degree * centroid
-                denominator += degree
-
-            results[var_name] = numerator / denominator if denominator > 0 else 0
-
-        return results
+    def run_simulation(self, crisp_values):
+        """Defuzzified output for each output variable that has rules.
+
+        crisp_values is either a mapping of variable names to values or a
+        sequence of values ordered like the IN variables were added. A mapping
+        only needs the IN variables the rules actually read; values for other
+        defined variables are ignored, and undefined names raise KeyError.
+        """
+        self._ensure_compiled()
+        return dict(zip(self._output_names(), self._program(self._crisp_vector(crisp_values))))
+
+    def run_simulation_batch(self, batch):
+        """Run the simulation for each row of crisp values in batch.
+
+        With Numba installed, the rows are evaluated in parallel by a
+        table-driven kernel over the packed rule base, whose compile cost does
+        not depend on the number of rules; otherwise they run one after
+        another through the generated program.
+        """
+        self._ensure_compiled()
+        rows = [self._crisp_vector(crisp_values) for crisp_values in batch]
+        if HAVE_NUMBA:
+            if self._packed is None:
+                self._packed = pack_rule_base(
+                    [params for variable in self._inputs for params in variable._abcd],
+                    [i for i, variable in enumerate(self._inputs) for _ in variable._abcd],
+                    self._rule_table,
+                    [variable._centroids for variable in self._outputs],
+                )
+            values = simulate_batch(self._packed, rows, len(self._inputs))
+        else:
+            values = [self._program(x) for x in rows]
+        names = self._output_names()
+        return [dict(zip(names, row)) for row in values]
+
+    def _output_names(self):
+        return [variable.name for variable in self._outputs]
+
+    def _crisp_vector(self, crisp_values):
+        if isinstance(crisp_values, dict):
+            x = [None] * len(self._inputs)
+            for var_name, crisp_value in crisp_values.items():
+                idx = self._in_var_index.get(var_name)
+                if idx is not None:
+                    x[idx] = crisp_value
+                elif var_name not in self.variables:
+                    raise KeyError(var_name)
+            for idx in self._read_inputs:
+                if x[idx] is None:
+                    raise KeyError(self._inputs[idx].name)
+            x = [0.0 if value is None else value for value in x]  # Unread inputs
+        elif len(crisp_values) == len(self._inputs):
+            x = crisp_values
+        else:
+            raise ValueError(f"Expected {len(self._inputs)} crisp values, got {len(crisp_values)}")
+        return x
 
 def load_test_case(system):
     # Add variables
@@ -132,6 +322,18 @@ def load_test_case(system):
     system.add_rule(([("proj_funding", "low", "and"), ("exp_level", "beginner", "and")], "risk", "high"))
     system.add_rule(([("proj_funding", "very_low", "and_not"), ("exp_level", "expert", "and_not")], "risk", "high"))
 
+_TEST_SYSTEM = None
+
+def get_test_system():
+    """Return the predefined test system, building and compiling it on first use."""
+    global _TEST_SYSTEM
+    if _TEST_SYSTEM is None:
+        system = FuzzySystem("test_case", "Predefined system for testing.")
+        load_test_case(system)
+        system._ensure_compiled()
+        _TEST_SYSTEM = system
+    return _TEST_SYSTEM
+
 def main():
     print("Fuzzy Logic")
     print("===================")
@@ -206,21 +408,12 @@ def main():
                             break
 
                         try:
-                            parts = rule_input.split(" => ")
+                            parts = _RULE_ARROW.split(rule_input, maxsplit=1)
                             if len(parts) != 2:
                                 raise ValueError("Invalid rule format. Use 'var set op var set => out_var out_set'.")
 
                             in_part, out_part = parts
-                            in_vars = []
-                            conditions = in_part.split(" ")
-                            idx = 0
-                            while idx < len(conditions):
-                                var_name = conditions[idx]
-                                set_name = conditions[idx + 1]
-                                operator = conditions[idx + 2] if idx + 2 < len(conditions) and conditions[idx + 2] in {"and", "or", "and_not"} else "and"  # Default to "and" if no operator specified
-                                 
-                                in_vars.append((var_name, set_name, operator))
-                                idx += 3 if operator else 2  
+                            in_vars = _parse_antecedents(in_part)
 
                             out_var, out_set = out_part.split()
                             system.add_rule((in_vars, out_var, out_set))
@@ -245,11 +438,15 @@ def main():
                                 continue
 
                     print("\nRunning the simulation...")
+                    try:
+                        results = system.run_simulation(crisp_values)
+                    except KeyError as e:
+                        print(f"Error: Variable or set {e} is not defined or has no crisp value.")
+                        continue
                     print("Fuzzification => done")
                     print("Inference => done")
                     print("Defuzzification => done")
 
-                    results = system.run_simulation(crisp_values)
                     for var_name, result in results.items():
                         print(f"The predicted {var_name} is {result:.1f}")
 
@@ -258,8 +455,7 @@ def main():
                 else:
                     print("Invalid choice. Please try again.")
         elif choice == "2":
-            system = FuzzySystem("test_case", "Predefined system for testing.")
-            load_test_case(system)
+            system = get_test_system()
             test_inputs = {"proj_funding": 50, "exp_level": 40}
             print("Test Inputs:", test_inputs)
             results = system.run_simulation(test_inputs)
@@ -0,0 +1,189 @@
+import random
+import time
+import unittest
+from fractions import Fraction
+
+from code_1 import FuzzySet, FuzzySystem, Op, Variable, get_test_system, load_test_case
+
+
+def reference_fuzzify(fuzzy_set, x):
+    """Piecewise membership, written independently of the compiled clamp."""
+    if fuzzy_set.type == "TRI":
+        a, b, d = fuzzy_set.values
+        c = b
+    else:
+        a, b, c, d = fuzzy_set.values
+    if b <= x <= c:
+        return 1.0
+    if a < x < b:
+        return (x - a) / (b - a)
+    if c < x < d:
+        return (d - x) / (d - c)
+    return 0.0
+
+
+def reference_simulation(system, crisp_values):
+    """Interpret the rule base directly: fold antecedents from 1, max-aggregate, centroid-average."""
+    inferred = {}
+    for in_vars, out_var, out_set in system.rules:
+        degree = 1.0
+        for var_name, set_name, operator in in_vars:
+            variable = system.variables[var_name]
+            idx = variable.set_names.get(set_name)
+            mu = 0.0 if idx is None else reference_fuzzify(variable.sets[idx], crisp_values[var_name])
+            if operator == Op.OR:
+                degree = max(degree, mu)
+            elif operator == Op.AND_NOT:
+                degree = min(degree, 1 - mu)
+            else:
+                degree = min(degree, mu)
+        sets = inferred.setdefault(out_var, {})
+        sets[out_set] = max(sets.get(out_set, 0.0), degree)
+
+    results = {}
+    for var_name, sets in inferred.items():
+        variable = system.variables[var_name]
+        numerator = sum(d * variable.sets[variable.set_names[s]].centroid for s, d in sets.items())
+        denominator = sum(sets.values())
+        results[var_name] = numerator / denominator if denominator > 0 else 0
+    return results
+
+
+def random_set(rng, name, lo, hi):
+    if rng.random() < 0.5:
+        return FuzzySet(name, "TRI", sorted(rng.uniform(lo, hi) for _ in range(3)))
+    return FuzzySet(name, "TRAP", sorted(rng.uniform(lo, hi) for _ in range(4)))
+
+
+def random_system(rng, n_inputs=3, n_sets=5, n_rules=40, max_antecedents=5):
+    system = FuzzySystem("random", "Randomly generated system.")
+    for i in range(n_inputs):
+        variable = Variable(f"in{i}", "IN", [0, 100])
+        for j in range(n_sets):
+            variable.add_fuzzy_set(random_set(rng, f"s{j}", 0, 100))
+        system.add_variable(variable)
+    for i in range(2):
+        variable = Variable(f"out{i}", "OUT", [0, 100])
+        for j in range(n_sets):
+            variable.add_fuzzy_set(random_set(rng, f"s{j}", 0, 100))
+        system.add_variable(variable)
+
+    for _ in range(n_rules):
+        in_vars = [
+            (f"in{rng.randrange(n_inputs)}", f"s{rng.randrange(n_sets + 1)}",  # s{n_sets} is unknown
+             rng.choice(["and", "or", "and_not"]))
+            for _ in range(rng.randint(1, max_antecedents))
+        ]
+        system.add_rule((in_vars, f"out{rng.randrange(2)}", f"s{rng.randrange(n_sets)}"))
+    return system
+
+
+class GeneratedProgramTest(unittest.TestCase):
+    def assertMatchesReference(self, system, crisp_values):
+        expected = reference_simulation(system, crisp_values)
+        results = system.run_simulation(crisp_values)
+        self.assertEqual(set(results), set(expected))
+        for var_name, value in expected.items():
+            self.assertAlmostEqual(results[var_name], value, places=9)
+
+    def test_predefined_case(self):
+        results = get_test_system().run_simulation({"proj_funding": 50, "exp_level": 40})
+        self.assertAlmostEqual(results["risk"], 48.611111111111114)
+
+    def test_random_systems_match_reference(self):
+        rng = random.Random(1234)
+        for _ in range(50):
+            system = random_system(rng)
+            for _ in range(20):
+                crisp_values = {f"in{i}": rng.uniform(-10, 110) for i in range(3)}
+                self.assertMatchesReference(system, crisp_values)
+
+    def test_long_or_chain(self):
+        rng = random.Random(7)
+        system = random_system(rng, n_rules=0)
+        in_vars = [("in0", "s0", "and")] + [(f"in{i % 3}", f"s{i % 5}", "or") for i in range(1000)]
+        system.add_rule((in_vars, "out0", "s0"))
+        self.assertMatchesReference(system, {"in0": 20.0, "in1": 50.0, "in2": 80.0})
+
+    def test_wide_output_variable(self):
+        system = FuzzySystem("wide", "One output with thousands of sets.")
+        system.add_variable(Variable("x", "IN", [0, 100]))
+        system.add_variable(Variable("o", "OUT", [0, 100]))
+        system.variables["x"].add_fuzzy_set(FuzzySet("all", "TRAP", [0, 0, 100, 100]))
+        for j in range(5000):
+            system.variables["o"].add_fuzzy_set(FuzzySet(f"s{j}", "TRI", [0, 1, 2]))
+            system.add_rule(([("x", "all", "and")], "o", f"s{j}"))
+        self.assertMatchesReference(system, {"x": 50.0})
+
+    def test_system_without_rules(self):
+        system = FuzzySystem("empty", "No rules yet.")
+        system.add_variable(Variable("x", "IN", [0, 100]))
+        system.variables["x"].add_fuzzy_set(FuzzySet("s", "TRI", [0, 50, 100]))
+        self.assertEqual(system.run_simulation({"x": 25}), {})
+        self.assertEqual(system.run_simulation_batch([[25], [75]]), [{}, {}])
+
+    def test_non_float_set_values(self):
+        # Parameters are baked into generated source, so they must be plain floats.
+        system = FuzzySystem("fractions", "Set values given as Fractions.")
+        system.add_variable(Variable("x", "IN", [0, 100]))
+        system.add_variable(Variable("o", "OUT", [0, 100]))
+        system.variables["x"].add_fuzzy_set(FuzzySet("s", "TRI", [Fraction(0), Fraction(50), Fraction(100)]))
+        system.variables["o"].add_fuzzy_set(FuzzySet("s", "TRAP", [Fraction(0), Fraction(1, 3), Fraction(2), Fraction(3)]))
+        system.add_rule(([("x", "s", "and")], "o", "s"))
+        self.assertMatchesReference(system, {"x": 25})
+
+    def test_dict_inputs_only_need_read_variables(self):
+        system = get_test_system()
+        expected = system.run_simulation({"proj_funding": 50, "exp_level": 40})
+        self.assertEqual(system.run_simulation({"proj_funding": 50, "exp_level": 40, "risk": 10}), expected)
+        with self.assertRaises(KeyError):
+            system.run_simulation({"proj_funding": 50})
+        with self.assertRaises(KeyError):
+            system.run_simulation({"proj_funding": 50, "exp_level": 40, "unknown": 1})
+
+        system = FuzzySystem("partial", "One input is never read.")
+        for name, var_type in [("x", "IN"), ("unused", "IN"), ("o", "OUT")]:
+            system.add_variable(Variable(name, var_type, [0, 100]))
+            system.variables[name].add_fuzzy_set(FuzzySet("s", "TRI", [0, 50, 100]))
+        system.add_rule(([("x", "s", "and")], "o", "s"))
+        self.assertAlmostEqual(system.run_simulation({"x": 25})["o"], 50.0)
+
+    def test_antecedents_must_name_input_variables(self):
+        for var_name in ["proj_fundng", "risk"]:
+            system = FuzzySystem("test_case", "Predefined system for testing.")
+            load_test_case(system)
+            system.add_rule(([("proj_funding", "high", "and"), (var_name, "high", "and_not")], "risk", "low"))
+            with self.assertRaises(KeyError):
+                system.run_simulation({"proj_funding": 50, "exp_level": 40})
+
+    def test_unknown_set_name_has_zero_degree(self):
+        system = FuzzySystem("test_case", "Predefined system for testing.")
+        load_test_case(system)
+        system.add_rule(([("proj_funding", "huge", "and_not")], "risk", "high"))
+        self.assertMatchesReference(system, {"proj_funding": 50, "exp_level": 40})
+
+    def test_batch_matches_single_runs(self):
+        rng = random.Random(99)
+        system = random_system(rng)
+        rows = [[rng.uniform(-10, 110) for _ in range(3)] for _ in range(100)]
+        batch = system.run_simulation_batch(rows)
+        self.assertEqual(len(batch), len(rows))
+        for row, results in zip(rows, batch):
+            expected = system.run_simulation(row)
+            self.assertEqual(set(results), set(expected))
+            for var_name, value in expected.items():
+                self.assertAlmostEqual(results[var_name], value, places=9)
+
+    def test_batch_cost_does_not_grow_with_compiled_rules(self):
+        # JIT-compiling the generated program took ~19 s at this size; the
+        # table-driven kernel compiles once (~3 s cold) whatever the rule count.
+        rng = random.Random(400)
+        system = random_system(rng, n_inputs=4, n_rules=400)
+        rows = [[rng.uniform(-10, 110) for _ in range(4)] for _ in range(1000)]
+        start = time.perf_counter()
+        system.run_simulation_batch(rows)
+        self.assertLess(time.perf_counter() - start, 10.0)
+
+
+if __name__ == "__main__":
+    unittest.main()